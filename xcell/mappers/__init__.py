@@ -23,8 +23,8 @@ from .mapper_NVSS import MapperNVSS
 from .mapper_CatWISE import MapperCatWISE
 from .mapper_ROSAT import MapperROSATXray
 from .mapper_dummy import MapperDummy
-from .utils import (get_map_from_points, get_DIR_Nz, get_beam,
-                    get_rerun_data, save_rerun_data)
+from .utils import (get_map_from_points, get_maps_from_points, get_ipix,
+                    get_DIR_Nz, get_beam, get_rerun_data, save_rerun_data)
 
 
 def mapper_from_name(name):
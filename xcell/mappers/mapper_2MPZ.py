@@ -1,5 +1,5 @@
 from .mapper_base import MapperBase
-from .utils import get_map_from_points, get_DIR_Nz
+from .utils import get_map_from_points, get_ipix, get_DIR_Nz
 import fitsio
 import numpy as np
 import healpy as hp
@@ -14,7 +14,8 @@ class Mapper2MPZ(MapperBase):
            'mask': 'mask.fits',
            'z_edges': [0, 0.5],
            'n_jk_dir': 100,
-           'mask_name': 'mask_2MPZ'}
+           'mask_name': 'mask_2MPZ',
+           'nthreads': 1}
         """
         self._get_defaults(config)
         self.z_edges = config.get('z_edges', [0, 0.5])
@@ -22,6 +23,10 @@ class Mapper2MPZ(MapperBase):
 
         self.cat_data = None
         self.npix = hp.nside2npix(self.nside)
+        self._ipix = None
+        self._nmap_data = None
+        self._mean_n = None
+        self._mask_sum = None
 
         # Angular mask
         self.dndz = None
@@ -51,10 +56,18 @@ class Mapper2MPZ(MapperBase):
 
     def _mask_catalog(self, cat):
         self.mask = self.get_mask()
-        ipix = hp.ang2pix(self.nside, cat[self.ra_name],
-                          cat[self.dec_name], lonlat=True)
+        ipix = get_ipix(self.nside, cat[self.ra_name], cat[self.dec_name],
+                        nthreads=self.config.get('nthreads', 1))
         # Mask is binary, so 0.1 or 0.00001 doesn't really matter.
-        return cat[self.mask[ipix] > 0.1]
+        good = self.mask[ipix] > 0.1
+        # Keep pixel indices of the surviving sources
+        self._ipix = ipix[good]
+        return cat[good]
+
+    def _get_ipix(self):
+        # Computed alongside the catalog in _mask_catalog
+        self.get_catalog()
+        return self._ipix
 
     def _bin_z(self, cat):
         return cat[(cat['ZPHOTO'] > self.z_edges[0]) &
@@ -69,12 +82,15 @@ class Mapper2MPZ(MapperBase):
         c_s = self._get_specsample(c_p)
         # Sort spec sample by nested pixel index so jackknife
         # samples are spatially correlated.
-        ip_s = hp.ring2nest(self.nside,
-                            hp.ang2pix(self.nside,
-                                       c_s[self.ra_name],
-                                       c_s[self.dec_name],
-                                       lonlat=True))
-        idsort = np.argsort(ip_s)
+        # Nested indices at a coarser resolution label the parent
+        # pixels (they're the fine indices shifted right by 2 bits
+        # per factor 2 in nside), so sorting at nside <= 64 still
+        # keeps jackknife regions compact. Those indices fit in 16
+        # bits, for which numpy's stable sort is a radix sort.
+        nside_jk = min(self.nside, 64)
+        ip_s = get_ipix(nside_jk, c_s[self.ra_name], c_s[self.dec_name],
+                        nest=True)
+        idsort = np.argsort(ip_s.astype(np.uint16), kind='stable')
         c_s = c_s[idsort]
         # Compute DIR N(z)
         z, nz, nz_jk = get_DIR_Nz(c_s, c_p,
@@ -94,18 +110,28 @@ class Mapper2MPZ(MapperBase):
             self.dndz = self._rerun_read_cycle(fn, 'NPZ', self._get_nz)
         return self._get_shifted_nz(dz, return_jk_error=return_jk_error)
 
+    def _get_count_map(self):
+        # Number counts map and its mean over the mask, shared
+        # by the signal map and the noise power spectrum.
+        if self._nmap_data is None:
+            self.cat_data = self.get_catalog()
+            self.mask = self.get_mask()
+            self._nmap_data = get_map_from_points(self.cat_data, self.nside,
+                                                  ipix=self._get_ipix())
+            self._mean_n = (np.dot(self._nmap_data, self.mask) /
+                            self._mask_sum)
+        return self._nmap_data, self._mean_n
+
     def get_signal_map(self, apply_galactic_correction=True):
         if self.delta_map is None:
             d = np.zeros(self.npix)
-            self.cat_data = self.get_catalog()
-            self.mask = self.get_mask()
-            nmap_data = get_map_from_points(self.cat_data, self.nside,
-                                            ra_name=self.ra_name,
-                                            dec_name=self.dec_name)
-            mean_n = np.average(nmap_data, weights=self.mask)
+            nmap_data, mean_n = self._get_count_map()
             goodpix = self.mask > 0
             # Division by mask not really necessary, since it's binary.
-            d[goodpix] = nmap_data[goodpix]/(mean_n*self.mask[goodpix])-1
+            # d = n/(mean_n*mask) - 1, computed in place.
+            np.multiply(self.mask, mean_n, out=d, where=goodpix)
+            np.divide(nmap_data, d, out=d, where=goodpix)
+            np.subtract(d, 1, out=d, where=goodpix)
             self.delta_map = d
         return [self.delta_map]
 
@@ -113,18 +139,14 @@ class Mapper2MPZ(MapperBase):
         if self.mask is None:
             self.mask = hp.ud_grade(hp.read_map(self.config['mask']),
                                     nside_out=self.nside)
+            self._mask_sum = np.sum(self.mask)
         return self.mask
 
     def get_nl_coupled(self):
         if self.nl_coupled is None:
-            self.cat_data = self.get_catalog()
-            self.mask = self.get_mask()
-            nmap_data = get_map_from_points(self.cat_data, self.nside,
-                                            ra_name=self.ra_name,
-                                            dec_name=self.dec_name)
-            N_mean = np.average(nmap_data, weights=self.mask)
+            nmap_data, N_mean = self._get_count_map()
             N_mean_srad = N_mean * self.npix / (4 * np.pi)
-            N_ell = np.mean(self.mask) / N_mean_srad
+            N_ell = self._mask_sum / self.npix / N_mean_srad
             self.nl_coupled = N_ell * np.ones((1, 3*self.nside))
         return self.nl_coupled
 
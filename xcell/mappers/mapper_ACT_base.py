@@ -1,5 +1,7 @@
 from .mapper_base import MapperBase
+from .utils import get_rerun_data
 from pixell import enmap, reproject
+import numpy as np
 
 
 class MapperACTBase(MapperBase):
@@ -29,10 +31,27 @@ class MapperACTBase(MapperBase):
         msk = reproject.healpix_from_enmap(self.pixell_mask,
                                            lmax=self.lmax,
                                            nside=self.nside)
-        return msk
+        return msk.astype(np.float32)
+
+    def _get_ACT_map(self, name, func, dtype=None):
+        # Reprojected maps are cached as .npy rerun files and read
+        # back memory-mapped. Rerun maps saved as .fits.gz by older
+        # versions are still used (and converted) if present.
+        # The maps returned are always read-only.
+        fn = f'ACT_{self.map_name}_{name}'
+
+        def get_map():
+            mp = get_rerun_data(self, fn + '.fits.gz', 'FITSMap')
+            if mp is None:
+                mp = func()
+            return np.asarray(mp, dtype=dtype)
+
+        mp = self._rerun_read_cycle(fn + '.npy', 'NPY', get_map)
+        mp.flags.writeable = False
+        return mp
 
     def get_mask(self):
         if self.mask is None:
-            fn = f'ACT_{self.map_name}_mask.fits.gz'
-            self.mask = self._rerun_read_cycle(fn, 'FITSMap', self._get_mask)
+            self.mask = self._get_ACT_map('mask', self._get_mask,
+                                          dtype=np.float32)
         return self.mask
@@ -26,8 +26,7 @@ class MapperACTk(MapperACTBase):
 
     def get_signal_map(self):
         if self.signal_map is None:
-            fn = f'ACT_{self.map_name}_signal.fits.gz'
-            mp = self._rerun_read_cycle(fn, 'FITSMap', self._get_signal_map)
+            mp = self._get_ACT_map('signal', self._get_signal_map)
             self.signal_map = [mp]
         return self.signal_map
 
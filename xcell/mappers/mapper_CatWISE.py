@@ -1,8 +1,24 @@
 from .mapper_base import MapperBase
-from .utils import get_map_from_points
+from .utils import get_map_from_points, get_ipix
 from astropy.table import Table
 import numpy as np
+import fitsio
 import healpy as hp
+import functools
+
+
+@functools.lru_cache(maxsize=4)
+def _get_galactic_cut(nside, b_max):
+    # Pixels with galactic latitude |b| < b_max, for a map in
+    # celestial coordinates. Cached, since the rotation of all pixel
+    # centres is expensive at high nside.
+    r = hp.Rotator(coord=['C', 'G'])
+    RApix, DEpix = hp.pix2ang(nside, np.arange(hp.nside2npix(nside)),
+                              lonlat=True)
+    lpix, bpix = r(RApix, DEpix, lonlat=True)
+    cut = np.fabs(bpix) < b_max
+    cut.flags.writeable = False
+    return cut
 
 
 class MapperCatWISE(MapperBase):
@@ -12,11 +28,16 @@ class MapperCatWISE(MapperBase):
           {'data_catalog': 'xcell/tests/data/
           catwise_agns_masked_final_w1lt16p5_alpha.fits',
            'mask': 'xcell/tests/data/MASKS_exclude_master_final.fits',
-           'mask_name': 'mask_CatWISE'}
+           'mask_name': 'mask_CatWISE',
+           'nthreads': 1}
         """
         self._get_defaults(config)
         self.file_sourcemask = config.get('mask_sources', None)
         self.cat_data = None
+        self._ipix = None
+        self._nmap_data = None
+        self._mean_n = None
+        self._mask_sum = None
 
         self.npix = hp.nside2npix(self.nside)
         # Angular mask
@@ -30,50 +51,64 @@ class MapperCatWISE(MapperBase):
     def get_catalog(self):
         if self.cat_data is None:
             file_data = self.config['data_catalog']
-            self.cat_data = Table.read(file_data)
+            self.cat_data = fitsio.read(file_data, ext=1,
+                                        columns=['ra', 'dec', 'w1'])
             # Flux condition
             self.cat_data = self.cat_data[
                 (self.cat_data['w1'] <
                  self.config.get('flux_max_W1', 16.4))]
         return self.cat_data
 
+    def _get_ipix(self):
+        if self._ipix is None:
+            cat = self.get_catalog()
+            self._ipix = get_ipix(self.nside, cat['ra'], cat['dec'],
+                                  nthreads=self.config.get('nthreads', 1))
+        return self._ipix
+
+    def _get_count_map(self):
+        # Number counts map and its mean over the mask, shared
+        # by the signal map and the noise power spectrum.
+        if self._nmap_data is None:
+            self.cat_data = self.get_catalog()
+            self.mask = self.get_mask()
+            self._nmap_data = get_map_from_points(self.cat_data, self.nside,
+                                                  ipix=self._get_ipix())
+            self._mean_n = (np.dot(self._nmap_data, self.mask) /
+                            self._mask_sum)
+        return self._nmap_data, self._mean_n
+
     # Density Map
     def get_signal_map(self, apply_galactic_correction=True):
         if self.delta_map is None:
             d = np.zeros(self.npix)
-            self.cat_data = self.get_catalog()
-            self.mask = self.get_mask()
-            nmap_data = get_map_from_points(self.cat_data, self.nside,
-                                            ra_name='ra',
-                                            dec_name='dec')
-            mean_n = np.average(nmap_data, weights=self.mask)
+            nmap_data, mean_n = self._get_count_map()
             goodpix = self.mask > 0
             # Division by mask not really necessary, since it's binary.
-            d[goodpix] = nmap_data[goodpix]/(mean_n*self.mask[goodpix])-1
+            # d = n/(mean_n*mask) - 1, computed in place.
+            np.multiply(self.mask, mean_n, out=d, where=goodpix)
+            np.divide(nmap_data, d, out=d, where=goodpix)
+            np.subtract(d, 1, out=d, where=goodpix)
             self.delta_map = d
         return [self.delta_map]
 
     def _cut_mask(self):
         mask = np.ones(self.npix)
-        r = hp.Rotator(coord=['C', 'G'])
-        RApix, DEpix = hp.pix2ang(self.nside, np.arange(self.npix),
-                                  lonlat=True)
-        lpix, bpix = r(RApix, DEpix, lonlat=True)
         # angular conditions
-        mask[(np.fabs(bpix) < self.config.get('GLAT_max_deg',
-                                              30))] = 0
+        mask[_get_galactic_cut(self.nside,
+                               self.config.get('GLAT_max_deg', 30))] = 0
         if self.file_sourcemask is not None:
             # holes catalog
             mask_holes = Table.read(self.file_sourcemask)
             vecmask = hp.ang2vec(mask_holes['ra'],
                                  mask_holes['dec'],
                                  lonlat=True)
-            for vec, radius in zip(vecmask,
-                                   mask_holes['radius']):
-                ipix_hole = hp.query_disc(self.nside, vec,
-                                          np.radians(radius),
-                                          inclusive=True)
-                mask[ipix_hole] = 0
+            radmask = np.radians(mask_holes['radius'])
+            ipix_holes = [hp.query_disc(self.nside, vec, radius,
+                                        inclusive=True)
+                          for vec, radius in zip(vecmask, radmask)]
+            if len(ipix_holes) > 0:
+                mask[np.concatenate(ipix_holes)] = 0
         return mask
 
     def get_mask(self):
@@ -85,19 +120,15 @@ class MapperCatWISE(MapperBase):
                 fn = f'CatWise_cutout_mask_ns{self.nside}.fits.gz'
                 self.mask = self._rerun_read_cycle(fn, 'FITSMap',
                                                    self._cut_mask)
+            self._mask_sum = np.sum(self.mask)
         return self.mask
 
     # Shot noise
     def get_nl_coupled(self):
         if self.nl_coupled is None:
-            self.cat_data = self.get_catalog()
-            self.mask = self.get_mask()
-            nmap_data = get_map_from_points(self.cat_data, self.nside,
-                                            ra_name='ra',
-                                            dec_name='dec')
-            N_mean = np.average(nmap_data, weights=self.mask)
+            nmap_data, N_mean = self._get_count_map()
             N_mean_srad = N_mean * self.npix / (4 * np.pi)
-            N_ell = np.mean(self.mask) / N_mean_srad
+            N_ell = self._mask_sum / self.npix / N_mean_srad
             self.nl_coupled = N_ell * np.ones((1, 3*self.nside))
         return self.nl_coupled
 
@@ -1,7 +1,9 @@
 from .mapper_base import MapperBase
-from .utils import get_map_from_points
-from astropy.table import Table, hstack
+from .utils import get_map_from_points, get_maps_from_points, get_ipix
+from astropy.table import Table
+import numpy.lib.recfunctions as rfn
 import numpy as np
+import fitsio
 import healpy as hp
 
 
@@ -17,6 +19,7 @@ class MapperDESY1wl(MapperBase):
            'nside': Nside,
            'zbin': zbin,
            'mask_name': name,
+           'nthreads': 1,
            }
         """
 
@@ -29,11 +32,14 @@ class MapperDESY1wl(MapperBase):
         self.dndz = None
         # load cat
         self.cat_data = None
+        self._ipix = None
         # get items for calibration
         self.Rs = None
 
         self.signal_map = None
         self.maps = {'PSF': None, 'shear': None}
+        # Un-normalized e1, e2 and w2s2 maps
+        self._point_maps = {'PSF': None, 'shear': None}
 
         self.mask = None
 
@@ -47,13 +53,21 @@ class MapperDESY1wl(MapperBase):
             # get items for calibration
             self.Rs = self._get_Rs()
             # clean data
-            self.cat_data.remove_rows(self.cat_data['zbin_mcal'] != self.zbin)
+            self.cat_data = self.cat_data[self.cat_data['zbin_mcal'] ==
+                                          self.zbin]
             # calibrate
-            self._remove_additive_bias()
-            self._remove_multiplicative_bias()
+            self._calibrate()
 
         return self.cat_data
 
+    def _get_ipix(self):
+        if self._ipix is None:
+            cat_data = self.get_catalog()
+            self._ipix = get_ipix(self.nside, cat_data['ra'],
+                                  cat_data['dec'],
+                                  nthreads=self.config.get('nthreads', 1))
+        return self._ipix
+
     def _load_catalog_from_raw(self):
         # Read catalogs
         # Columns explained in
@@ -67,35 +81,45 @@ class MapperDESY1wl(MapperBase):
         columns_zbin = ['zbin_mcal', 'zbin_mcal_1p',
                         'zbin_mcal_1m', 'zbin_mcal_2p', 'zbin_mcal_2m']
         print('Loading full cat')
-        cat = Table.read(self.config['data_cat'],
-                         format='fits', memmap=True)
-        cat.keep_columns(columns_data)
-        cat_zbin = Table.read(self.config['zbin_cat'],
-                              format='fits', memmap=True)
-        cat_zbin.keep_columns(columns_zbin)
-        cat = hstack([cat, cat_zbin])
-
-        # remove bins which are not the one of interest
-        # Logic: If item in one of zbins --> sel = False
-        # Thus it is not removed by next line
-        sel = (cat['zbin_mcal'] != self.zbin) * \
-            (cat['zbin_mcal_1p'] != self.zbin) * \
-            (cat['zbin_mcal_1m'] != self.zbin) * \
-            (cat['zbin_mcal_2p'] != self.zbin) * \
-            (cat['zbin_mcal_2m'] != self.zbin)
-        cat.remove_rows(sel)
+        # Read the columns needed for the cuts first
+        cat_zbin = self._read_columns(self.config['zbin_cat'], columns_zbin)
+        cat_cuts = self._read_columns(self.config['data_cat'],
+                                      ['dec', 'flags_select'])
+
+        # keep only objects in the bin of interest for any of
+        # the sheared catalogs
+        sel = ((cat_zbin['zbin_mcal'] == self.zbin) |
+               (cat_zbin['zbin_mcal_1p'] == self.zbin) |
+               (cat_zbin['zbin_mcal_1m'] == self.zbin) |
+               (cat_zbin['zbin_mcal_2p'] == self.zbin) |
+               (cat_zbin['zbin_mcal_2m'] == self.zbin))
         # filter for -90<dec<-35
-        cat.remove_rows(cat['dec'] < -90)
-        cat.remove_rows(cat['dec'] > -35)
+        sel &= (cat_cuts['dec'] >= -90) & (cat_cuts['dec'] <= -35)
         # remove flagged galaxies
-        cat.remove_rows(cat['flags_select'] != 0)
-        return cat.as_array()
+        sel &= cat_cuts['flags_select'] == 0
+        rows = np.flatnonzero(sel)
+
+        # Now read only the selected rows
+        cat = self._read_columns(self.config['data_cat'], columns_data,
+                                 rows=rows)
+        cat = rfn.merge_arrays([cat, cat_zbin[rows]], flatten=True,
+                               usemask=False)
+        return cat
+
+    def _read_columns(self, fname, columns, rows=None):
+        # Read only the requested columns, keeping their order
+        # in the file. Columns are selected by index, since fitsio
+        # matches names case-insensitively.
+        with fitsio.FITS(fname) as f:
+            icols = [i for i, c in enumerate(f[1].get_colnames())
+                     if c in columns]
+            return f[1].read(columns=icols, rows=rows)
 
     def _load_catalog(self):
         fn = f'DESY1wl_catalog_rerun_bin{self.zbin}.fits'
         cat = self._rerun_read_cycle(fn, 'FITSTable',
                                      self._load_catalog_from_raw)
-        return Table(cat)
+        return cat
 
     def _set_mode(self, mode=None):
         if mode is None:
@@ -113,32 +137,29 @@ class MapperDESY1wl(MapperBase):
 
     def _get_Rs(self):
         if self.Rs is None:
-            data_1p = self.cat_data[self.cat_data['zbin_mcal_1p'] == self.zbin]
-            data_1m = self.cat_data[self.cat_data['zbin_mcal_1m'] == self.zbin]
-            data_2p = self.cat_data[self.cat_data['zbin_mcal_2p'] == self.zbin]
-            data_2m = self.cat_data[self.cat_data['zbin_mcal_2m'] == self.zbin]
-
-            mean_e1_1p = np.mean(data_1p['e1'])
-            mean_e2_1p = np.mean(data_1p['e2'])
-            mean_e1_1m = np.mean(data_1m['e1'])
-            mean_e2_1m = np.mean(data_1m['e2'])
-            mean_e1_2p = np.mean(data_2p['e1'])
-            mean_e2_2p = np.mean(data_2p['e2'])
-            mean_e1_2m = np.mean(data_2m['e1'])
-            mean_e2_2m = np.mean(data_2m['e2'])
-
-            self.Rs = np.array([[(mean_e1_1p-mean_e1_1m)/0.02,
-                                 (mean_e1_2p-mean_e1_2m)/0.02],
-                                [(mean_e2_1p-mean_e2_1m)/0.02,
-                                 (mean_e2_2p-mean_e2_2m)/0.02]])
+            # Mean ellipticities of the sheared samples, computed
+            # without copying the catalog for each of them.
+            e1 = self.cat_data['e1']
+            e2 = self.cat_data['e2']
+            mean_e1 = {}
+            mean_e2 = {}
+            for sh in ['1p', '1m', '2p', '2m']:
+                sel = self.cat_data[f'zbin_mcal_{sh}'] == self.zbin
+                n = np.count_nonzero(sel)
+                mean_e1[sh] = np.sum(e1, where=sel) / n
+                mean_e2[sh] = np.sum(e2, where=sel) / n
+
+            self.Rs = np.array([[(mean_e1['1p']-mean_e1['1m'])/0.02,
+                                 (mean_e1['2p']-mean_e1['2m'])/0.02],
+                                [(mean_e2['1p']-mean_e2['1m'])/0.02,
+                                 (mean_e2['2p']-mean_e2['2m'])/0.02]])
         return self.Rs
 
-    def _remove_additive_bias(self):
-        self.cat_data['e1'] -= np.mean(self.cat_data['e1'])
-        self.cat_data['e2'] -= np.mean(self.cat_data['e2'])
-        return
-
-    def _remove_multiplicative_bias(self):
+    def _calibrate(self):
+        # Remove additive bias
+        mean_e1 = np.mean(self.cat_data['e1'])
+        mean_e2 = np.mean(self.cat_data['e2'])
+        # Remove multiplicative bias
         # Should be done only with galaxies truly in zbin
         Rg = np.array([[np.mean(self.cat_data['R11']),
                         np.mean(self.cat_data['R12'])],
@@ -147,26 +168,34 @@ class MapperDESY1wl(MapperBase):
         Rmat = Rg + self.Rs
         one_plus_m = np.sum(np.diag(Rmat))*0.5
 
-        self.cat_data['e1'] /= one_plus_m
-        self.cat_data['e2'] /= one_plus_m
+        # Both corrections applied in place on the catalog columns
+        for col, mean_e in zip(['e1', 'e2'], [mean_e1, mean_e2]):
+            e = self.cat_data[col]
+            e -= mean_e
+            e /= one_plus_m
         return
 
-    def _get_ellipticity_maps(self, mode=None):
+    def _get_point_maps(self, mode=None):
+        # Sums of e1, e2 and (e1^2+e2^2)/2 in each pixel, computed
+        # together in a single pass over the catalog.
         e1f, e2f, mod = self._set_mode(mode)
+        if self._point_maps[mod] is None:
+            cat_data = self.get_catalog()
+            e1 = cat_data[e1f]
+            e2 = cat_data[e2f]
+            self._point_maps[mod] = get_maps_from_points(
+                cat_data, self.nside, [e1, e2, 0.5*(e1**2 + e2**2)],
+                ipix=self._get_ipix())
+        return self._point_maps[mod]
+
+    def _get_ellipticity_maps(self, mode=None):
         print('Computing bin{} signal map'.format(self.zbin))
-        cat_data = self.get_catalog()
-        we1 = get_map_from_points(cat_data, self.nside,
-                                  w=cat_data[e1f],
-                                  ra_name='ra',
-                                  dec_name='dec')
-        we2 = get_map_from_points(cat_data, self.nside,
-                                  w=cat_data[e2f],
-                                  ra_name='ra',
-                                  dec_name='dec')
+        we1, we2, _ = self._get_point_maps(mode=mode)
         mask = self.get_mask()
         goodpix = mask > 0
-        we1[goodpix] /= mask[goodpix]
-        we2[goodpix] /= mask[goodpix]
+        # Normalize without modifying the cached maps
+        we1 = np.divide(we1, mask, out=np.zeros_like(we1), where=goodpix)
+        we2 = np.divide(we2, mask, out=np.zeros_like(we2), where=goodpix)
         return we1, we2
 
     def get_signal_map(self, mode=None):
@@ -197,7 +226,7 @@ class MapperDESY1wl(MapperBase):
     def _get_mask(self):
         cat_data = self.get_catalog()
         msk = get_map_from_points(cat_data, self.nside,
-                                  ra_name='ra', dec_name='dec')
+                                  ipix=self._get_ipix())
         return msk
 
     def get_mask(self):
@@ -217,13 +246,7 @@ class MapperDESY1wl(MapperBase):
 
         # This will only be computed if self.nls['mod'] is None
         def get_w2s2():
-            e1f, e2f, mod = self._set_mode(mode)
-            cat_data = self.get_catalog()
-            mp = get_map_from_points(cat_data, self.nside,
-                                     w=0.5*(cat_data[e1f]**2 +
-                                            cat_data[e2f]**2),
-                                     ra_name='ra', dec_name='dec')
-            return mp
+            return self._get_point_maps(mode=mode)[2]
 
         fn = f'DESY1wl_{mod}_w2s2_bin{self.zbin}_ns{self.nside}.fits.gz'
         w2s2 = self._rerun_read_cycle(fn, 'FITSMap', get_w2s2)
@@ -1,8 +1,10 @@
 from .mapper_base import MapperBase
-from .utils import get_map_from_points
+from .utils import get_maps_from_points
 from astropy.table import Table, vstack
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import fitsio
 import healpy as hp
 
 
@@ -18,6 +20,8 @@ class MapperHSCDR1wl(MapperBase):
          'fname_cosmos_ph': list of names of the photo-z COSMOS files
          'nbin_nz': number of intervals for redshift distribution (100)
          'zlim_nz': redshift range of redshift distribution (0-4)
+         'nthreads': number of threads used to process fields and
+                     compute pixel indices (1)
         }
         """
         self._get_defaults(config)
@@ -25,6 +29,17 @@ class MapperHSCDR1wl(MapperBase):
         self.z_edges = config['z_edges']
         self.bn = self.config['bin_name']
         self.w_name = 'ishape_hsm_regauss_derived_shape_weight'
+        # Photo-z and shape columns used after the raw catalog cuts
+        isn = 'ishape_hsm_regauss'
+        self.raw_pz_names = ['pz_best_eab']
+        self.raw_shape_names = [f'{isn}_{k}'
+                                for k in ['flags', 'sigma', 'resolution',
+                                          'e1', 'e2',
+                                          'derived_shear_bias_m',
+                                          'derived_shear_bias_c1',
+                                          'derived_shear_bias_c2',
+                                          'derived_rms_e',
+                                          'derived_shape_weight']]
         self.npix = hp.nside2npix(self.nside)
 
         self.nl_coupled = None
@@ -32,56 +47,82 @@ class MapperHSCDR1wl(MapperBase):
         self.cat = None
         self.mask = None
         self.signal_map = None
+        self._raw_columns = {}
+        self._point_maps = None
 
-    def _get_catalog_from_raw(self):
-        cats = []
-        for f in self.config['data_catalogs']:
-            cat = self._clean_raw_catalog(f)
+    def _get_field_catalog(self, fnames):
+        cat = self._clean_raw_catalog(fnames)
 
-            # Shear cut
-            shear_mod_thr = self.config.get('shear_mod_thr', 2)
-            isn = 'ishape_hsm_regauss'
-            ishape_flags_mask = ~cat[f'{isn}_flags']
-            ishape_sigma_mask = ~np.isnan(cat[f'{isn}_sigma'])
-            ishape_res_mask = cat[f'{isn}_resolution'] >= 0.3
-            ishape_shear_mod_mask = (cat[f'{isn}_e1']**2 +
-                                     cat[f'{isn}_e2']**2) < shear_mod_thr
-            ishape_sigma_mask *= ((cat[f'{isn}_sigma'] >= 0.) *
-                                  (cat[f'{isn}_sigma'] <= 0.4))
-            # Remove masked objects
-            imsk = 'iflags_pixel_bright'
-            star_mask = np.logical_not(cat[f'{imsk}_object_center'])
-            star_mask *= np.logical_not(cat[f'{imsk}_object_any'])
-            fdfc_mask = cat['wl_fulldepth_fullcolor']
-            shearmask = ishape_flags_mask *\
-                ishape_sigma_mask *\
-                ishape_res_mask *\
-                ishape_shear_mod_mask*star_mask *\
-                fdfc_mask
-            cat = cat[shearmask]
+        # Shear cut
+        shear_mod_thr = self.config.get('shear_mod_thr', 2)
+        isn = 'ishape_hsm_regauss'
+        sigma = cat[f'{isn}_sigma'].data
+        e1 = cat[f'{isn}_e1'].data
+        e2 = cat[f'{isn}_e2'].data
+        shearmask = ~cat[f'{isn}_flags'].data
+        # NaN sigmas fail both comparisons
+        shearmask &= sigma >= 0.
+        shearmask &= sigma <= 0.4
+        shearmask &= cat[f'{isn}_resolution'].data >= 0.3
+        shearmask &= (e1**2 + e2**2) < shear_mod_thr
+        # Remove masked objects
+        imsk = 'iflags_pixel_bright'
+        shearmask &= ~(cat[f'{imsk}_object_center'].data |
+                       cat[f'{imsk}_object_any'].data)
+        shearmask &= cat['wl_fulldepth_fullcolor'].data
 
-            # Redshift bin cut
-            zs = cat['pz_best_eab']
-            zbinmask = (zs <= self.z_edges[1]) & (zs > self.z_edges[0])
-            cat = cat[zbinmask]
+        # Redshift bin cut
+        zs = cat['pz_best_eab'].data
+        shearmask &= zs <= self.z_edges[1]
+        shearmask &= zs > self.z_edges[0]
+        cat = cat[shearmask]
 
-            # Calibrate shear
-            w = cat[self.w_name]
-            mhat = np.average(cat[f'{isn}_derived_shear_bias_m'],
-                              weights=w)
-            resp = 1. - np.average(cat[f'{isn}_derived_rms_e'] ** 2,
-                                   weights=w)
-            e1 = (cat[f'{isn}_e1']/(2.*resp) -
-                  cat[f'{isn}_derived_shear_bias_c1']) / (1 + mhat)
-            e2 = (cat[f'{isn}_e2']/(2.*resp) -
-                  cat[f'{isn}_derived_shear_bias_c2']) / (1 + mhat)
-            cat['e1'] = e1
-            cat['e2'] = e2
+        # Calibrate shear
+        w = cat[self.w_name].data
+        m = cat[f'{isn}_derived_shear_bias_m'].data
+        rms_e = cat[f'{isn}_derived_rms_e'].data
+        c1 = cat[f'{isn}_derived_shear_bias_c1'].data
+        c2 = cat[f'{isn}_derived_shear_bias_c2'].data
+        e1 = cat[f'{isn}_e1'].data
+        e2 = cat[f'{isn}_e2'].data
+        sumw = np.sum(w)
+        mhat = np.dot(w, m)/sumw
+        resp = 1. - np.dot(w, rms_e*rms_e)/sumw
+        e1 = np.divide(e1, 2.*resp)
+        e1 -= c1
+        e1 /= 1 + mhat
+        e2 = np.divide(e2, 2.*resp)
+        e2 -= c2
+        e2 /= 1 + mhat
+        return {'ra': cat['ra'].data, 'dec': cat['dec'].data,
+                'e1': e1, 'e2': e2, self.w_name: w}
 
-            # Remove unnecessary columns
-            cat.keep_columns(['ra', 'dec', 'e1', 'e2', self.w_name])
-            cats.append(cat)
-        return vstack(cats).as_array()
+    def _get_catalog_from_raw(self):
+        # Fields are independent, so they can be cleaned and
+        # calibrated in parallel threads. Each thread holds one
+        # field's temporaries, so this is off by default.
+        fields = self.config['data_catalogs']
+        nthreads = min(len(fields), self.config.get('nthreads', 1))
+        if nthreads > 1:
+            with ThreadPoolExecutor(nthreads) as ex:
+                cats = list(ex.map(self._get_field_catalog, fields))
+        else:
+            cats = [self._get_field_catalog(f) for f in fields]
+
+        # Fill a single output array rather than stacking tables.
+        # Same column order and (native) byte order as the rerun
+        # catalogs written by earlier versions.
+        names = ['ra', 'dec', self.w_name, 'e1', 'e2']
+        ngals = [len(c['ra']) for c in cats]
+        out = np.empty(np.sum(ngals),
+                       dtype=[(n, cats[0][n].dtype.newbyteorder('='))
+                              for n in names])
+        i0 = 0
+        for c, n in zip(cats, ngals):
+            for k in names:
+                out[k][i0:i0+n] = c[k]
+            i0 += n
+        return out
 
     def get_catalog(self):
         if self.cat is None:
@@ -90,84 +131,98 @@ class MapperHSCDR1wl(MapperBase):
                                               self._get_catalog_from_raw)
         return self.cat
 
+    def _get_raw_columns(self, c):
+        # Column classification only depends on the table schema,
+        # which is normally shared by all the raw files.
+        if c.dtype in self._raw_columns:
+            return self._raw_columns[c.dtype]
+
+        # Photo-z and shape columns don't enter the NaN cuts, so
+        # drop the unused ones before they're ever read from disk.
+        # Photo-z null flags still enter the null cuts, so keep them.
+        keep = [k for k in c.colnames
+                if (k in self.raw_pz_names) or
+                (k in self.raw_shape_names) or
+                not (k.startswith('ishape') or
+                     (k.startswith('pz_') and 'isnull' not in k))]
+        # Null flags, except for shapes
+        flag = [k for k in keep
+                if ('isnull' in k) and not k.startswith('ishape')]
+        # Keep photo-zs and shapes even if they're NaNs
+        nan = [k for k in keep
+               if not (k.startswith('pz_') or k.startswith('ishape') or
+                       ('isnull' in k)) and
+               np.issubdtype(c.dtype[k], np.floating)]
+        # Columns used after cleaning
+        imsk = 'iflags_pixel_bright'
+        clean = ['ra', 'dec', f'{imsk}_object_center', f'{imsk}_object_any',
+                 'wl_fulldepth_fullcolor'] + \
+            self.raw_pz_names + self.raw_shape_names
+        cols = {'keep': keep, 'flag': flag, 'nan': nan, 'clean': clean}
+        self._raw_columns[c.dtype] = cols
+        return cols
+
     def _clean_raw_catalog(self, fnames):
         cats = []
         for fname in fnames:
             if not os.path.isfile(fname):
                 raise ValueError(f"File {fname} not found")
-            c = Table.read(fname)
+            c = Table.read(fname, memmap=True)
+            cols = self._get_raw_columns(c)
+            c.keep_columns(cols['keep'])
             sel = np.ones(len(c), dtype=bool)
-            isnull_names = []
-            for key in c.keys():
-                if key.__contains__('isnull'):
-                    if not key.startswith('ishape'):
-                        sel[c[key]] = 0
-                    isnull_names.append(key)
-                else:
-                    # Keep photo-zs and shapes even if they're NaNs
-                    if ((not key.startswith("pz_")) and
-                            (not key.startswith('ishape'))):
-                        sel[np.isnan(c[key])] = 0
-            c.remove_columns(isnull_names)
-            c.remove_rows(~sel)
+            for k in cols['flag']:
+                sel &= ~c[k].data
+            for k in cols['nan']:
+                sel &= ~np.isnan(c[k].data)
 
-            # Collect sample cuts
-            sel_area = c['wl_fulldepth_fullcolor']
-            sel_clean = sel_area & c['clean_photometry']
-            sel_maglim = np.ones(len(c), dtype=bool)
-            sel_maglim[c['icmodel_mag'] -
-                       c['a_i'] > self.icut] = 0
+            # Collect sample cuts into the same running selection
+            sel &= c['wl_fulldepth_fullcolor'].data
+            sel &= c['clean_photometry'].data
+            sel &= c['icmodel_mag'] - c['a_i'] <= self.icut
             # Blending
-            sel_blended = np.ones(len(c), dtype=bool)
             # Shear sample cuts as defined in https://arxiv.org/abs/1705.06745
             # abs_flux<10^-0.375
-            sel_blended[c['iblendedness_abs_flux'] >= 0.42169650342] = 0
+            sel &= c['iblendedness_abs_flux'] < 0.42169650342
             # S/N in i
-            sel_fluxcut_i = np.ones(len(c), dtype=bool)
-            sel_fluxcut_i[c['icmodel_flux'] < 10*c['icmodel_flux_err']] = 0
-            # S/N in g
-            sel_fluxcut_g = np.ones(len(c), dtype=int)
-            sel_fluxcut_g[c['gcmodel_flux'] < 5*c['gcmodel_flux_err']] = 0
-            # S/N in r
-            sel_fluxcut_r = np.ones(len(c), dtype=int)
-            sel_fluxcut_r[c['rcmodel_flux'] < 5*c['rcmodel_flux_err']] = 0
-            # S/N in z
-            sel_fluxcut_z = np.ones(len(c), dtype=int)
-            sel_fluxcut_z[c['zcmodel_flux'] < 5*c['zcmodel_flux_err']] = 0
-            # S/N in y
-            sel_fluxcut_y = np.ones(len(c), dtype=int)
-            sel_fluxcut_y[c['ycmodel_flux'] < 5*c['ycmodel_flux_err']] = 0
+            sel &= c['icmodel_flux'] >= 10*c['icmodel_flux_err']
             # S/N in grzy (at least 2 pass)
-            sel_fluxcut_grzy = (sel_fluxcut_g+sel_fluxcut_r +
-                                sel_fluxcut_z+sel_fluxcut_y >= 2)
-            # Overall S/N
-            sel_fluxcut = sel_fluxcut_i*sel_fluxcut_grzy
-            # Stars
-            sel_stars = np.ones(len(c), dtype=bool)
-            sel_stars[c['iclassification_extendedness'] > 0.99] = 0
+            n_pass = np.zeros(len(c), dtype=int)
+            for b in ['g', 'r', 'z', 'y']:
+                n_pass += c[f'{b}cmodel_flux'] >= 5*c[f'{b}cmodel_flux_err']
+            sel &= n_pass >= 2
             # Galaxies
-            sel_gals = np.ones(len(c), dtype=bool)
-            sel_gals[c['iclassification_extendedness'] < 0.99] = 0
-            sel = ~(sel_clean*sel_maglim*sel_gals*sel_fluxcut*sel_blended)
-            c.remove_rows(sel)
+            sel &= c['iclassification_extendedness'] >= 0.99
+
+            # Only copy the columns used downstream when cutting rows
+            c.keep_columns(cols['clean'])
+            c.remove_rows(~sel)
             cats.append(c)
         return vstack(cats)
 
+    def _get_point_maps(self):
+        # Sums of w*e1, w*e2, w and w^2*(e1^2+e2^2)/2 in each pixel,
+        # computed together in a single pass over the catalog.
+        if self._point_maps is None:
+            cat = self.get_catalog()
+            w = cat[self.w_name]
+            e1 = cat['e1']
+            e2 = cat['e2']
+            self._point_maps = get_maps_from_points(
+                cat, self.nside,
+                [w*e1, w*e2, w, 0.5*(e1**2 + e2**2)*w**2],
+                ra_name='ra', dec_name='dec',
+                nthreads=self.config.get('nthreads', 1))
+        return self._point_maps
+
     def _get_ellip_maps(self):
         print(f'Computing bin {self.bn} signal map')
-        cat = self.get_catalog()
-        we1 = get_map_from_points(cat, self.nside,
-                                  w=cat['e1']*cat[self.w_name],
-                                  ra_name='ra',
-                                  dec_name='dec')
-        we2 = get_map_from_points(cat, self.nside,
-                                  w=cat['e2']*cat[self.w_name],
-                                  ra_name='ra',
-                                  dec_name='dec')
+        we1, we2, _, _ = self._get_point_maps()
         mask = self.get_mask()
         goodpix = mask > 0
-        we1[goodpix] /= mask[goodpix]
-        we2[goodpix] /= mask[goodpix]
+        # Normalize without modifying the cached maps
+        we1 = np.divide(we1, mask, out=np.zeros_like(we1), where=goodpix)
+        we2 = np.divide(we2, mask, out=np.zeros_like(we2), where=goodpix)
         return we1, we2
 
     def get_signal_map(self):
@@ -181,12 +236,7 @@ class MapperHSCDR1wl(MapperBase):
 
     def _get_mask(self):
         print(f'Computing bin {self.bn} mask')
-        cat = self.get_catalog()
-        msk = get_map_from_points(cat, self.nside,
-                                  w=cat[self.w_name],
-                                  ra_name='ra',
-                                  dec_name='dec')
-        return msk
+        return self._get_point_maps()[2]
 
     def get_mask(self):
         if self.mask is not None:
@@ -199,12 +249,7 @@ class MapperHSCDR1wl(MapperBase):
 
     def _get_w2s2(self):
         print('Computing w2s2 map')
-        cat = self.get_catalog()
-        w2s2 = get_map_from_points(cat, self.nside,
-                                   w=(0.5*(cat['e1']**2 + cat['e2']**2) *
-                                      cat[self.w_name]**2),
-                                   ra_name='ra', dec_name='dec')
-        return w2s2
+        return self._get_point_maps()[3]
 
     def get_nl_coupled(self):
         if self.nl_coupled is not None:
@@ -220,12 +265,24 @@ class MapperHSCDR1wl(MapperBase):
 
     def _get_nz(self):
         print('Computing nz')
-        cat_cosmos = Table.read(self.config['fname_cosmos'])
-        cat_photo = vstack([Table.read(n)
-                            for n in self.config['fnames_cosmos_ph']])
-        oid, id_ph, id_cs = np.intersect1d(cat_photo['ID'],
-                                           cat_cosmos['S17a_objid'],
-                                           return_indices=True)
+        # Only read the columns we need
+        cat_cosmos = fitsio.read(self.config['fname_cosmos'], ext=1,
+                                 columns=['S17a_objid', 'SOM_weight',
+                                          'weight_source', 'COSMOS_photoz'])
+        cat_photo = np.concatenate([fitsio.read(n, ext=1,
+                                                columns=['ID', 'PHOTOZ_BEST'])
+                                    for n in self.config['fnames_cosmos_ph']])
+        # Hash join on object IDs. Like np.intersect1d, only the first
+        # occurrence of each ID is matched.
+        import pandas as pd
+        ids_ph = pd.Index(np.asarray(cat_photo['ID'], dtype=np.int64))
+        ids_cs = pd.Index(np.asarray(cat_cosmos['S17a_objid'],
+                                     dtype=np.int64))
+        id_ph = np.flatnonzero(~ids_ph.duplicated())
+        id_cs = np.flatnonzero(~ids_cs.duplicated())
+        idx = ids_cs[id_cs].get_indexer(ids_ph[id_ph])
+        id_ph = id_ph[idx >= 0]
+        id_cs = id_cs[idx[idx >= 0]]
         cat_photo = cat_photo[id_ph]
         cat_cosmos = cat_cosmos[id_cs]
 
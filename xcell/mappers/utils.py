@@ -2,6 +2,7 @@ import numpy as np
 import healpy as hp
 import fitsio
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 
 def _build_rerun_fname(mpr, fname):
@@ -47,6 +48,9 @@ def get_rerun_data(mpr, fname, ftype, section=None, read=True):
     elif ftype == 'NPZ':
         d = np.load(fname_full)
         return dict(d)
+    elif ftype == 'NPY':
+        # Memory-mapped, read-only
+        return np.load(fname_full, mmap_mode='r')
     else:
         raise ValueError(f"Unknown file format {ftype}")
 
@@ -65,26 +69,75 @@ def save_rerun_data(mpr, fname, ftype, data):
         np.savetxt(fname_full, data)
     elif ftype == 'NPZ':
         np.savez(fname_full, **data)
+    elif ftype == 'NPY':
+        np.save(fname_full, data)
     else:
         raise ValueError(f"Unknown file format {ftype}")
 
 
+def _get_ipix(nside, ra, dec, nest, in_radians, dtype):
+    if in_radians:
+        theta = np.subtract(np.pi/2, dec, dtype=dtype)
+        phi = np.asarray(ra, dtype=dtype)
+    else:
+        theta = np.radians(dec, dtype=dtype)
+        np.subtract(np.pi/2, theta, out=theta)
+        phi = np.radians(ra, dtype=dtype)
+    return hp.ang2pix(nside, theta, phi, nest=nest)
+
+
+def get_ipix(nside, ra, dec, nest=False, in_radians=False, dtype=None,
+             nthreads=1):
+    # Equivalent to hp.ang2pix(nside, ra, dec, lonlat=True), but
+    # building theta and phi with as few temporary arrays as possible.
+    # If dtype is given (e.g. np.float32), theta and phi are computed
+    # with that precision, which halves the size of these temporaries.
+    # Note that healpy casts them back to float64, and single precision
+    # may move objects close to pixel boundaries, so mappers use the
+    # default double precision.
+    # If nthreads > 1, large catalogs are split into chunks hashed in
+    # separate threads (numpy and healpy ufunc loops run without
+    # holding the GIL).
+    ngal = len(ra)
+    nchunks = min(nthreads, ngal // 100000)
+    if nchunks <= 1:
+        return _get_ipix(nside, ra, dec, nest, in_radians, dtype)
+
+    ipix = np.empty(ngal, dtype=int)
+    edges = np.linspace(0, ngal, nchunks+1).astype(int)
+
+    def hash_chunk(i):
+        s = slice(edges[i], edges[i+1])
+        ipix[s] = _get_ipix(nside, ra[s], dec[s], nest, in_radians, dtype)
+
+    with ThreadPoolExecutor(nchunks) as ex:
+        list(ex.map(hash_chunk, range(nchunks)))
+    return ipix
+
+
 def get_map_from_points(cat, nside, w=None,
                         ra_name='RA', dec_name='DEC',
-                        in_radians=False):
+                        in_radians=False, ipix=None, nthreads=1):
     npix = hp.nside2npix(nside)
-    if in_radians:
-        ipix = hp.ang2pix(nside,
-                          np.degrees(cat[ra_name]),
-                          np.degrees(cat[dec_name]),
-                          lonlat=True)
-    else:
-        ipix = hp.ang2pix(nside, cat[ra_name], cat[dec_name],
-                          lonlat=True)
+    if ipix is None:
+        ipix = get_ipix(nside, cat[ra_name], cat[dec_name],
+                        in_radians=in_radians, nthreads=nthreads)
     numcount = np.bincount(ipix, weights=w, minlength=npix)
     return numcount
 
 
+def get_maps_from_points(cat, nside, ws,
+                         ra_name='RA', dec_name='DEC',
+                         in_radians=False, ipix=None, nthreads=1):
+    # Same as get_map_from_points, but for a list of weights.
+    # Pixel indices are only computed once for all maps.
+    npix = hp.nside2npix(nside)
+    if ipix is None:
+        ipix = get_ipix(nside, cat[ra_name], cat[dec_name],
+                        in_radians=in_radians, nthreads=nthreads)
+    return [np.bincount(ipix, weights=w, minlength=npix) for w in ws]
+
+
 def get_DIR_Nz(cat_spec, cat_photo, bands, zflag,
                zrange, nz, nearest_neighbors=10, njk=100,
                bands_photo=None):
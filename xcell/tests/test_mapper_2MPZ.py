@@ -3,6 +3,7 @@ import xcell as xc
 import healpy as hp
 import os
 import pytest
+import fitsio
 
 
 def get_config():
@@ -51,6 +52,52 @@ def test_get_nz():
     assert np.all(np.fabs(nz2-nz) < 1E-5)
 
 
+def test_get_nz_jk_ordering():
+    # Jackknife regions are built by sorting the spec sample on
+    # coarse (nside <= 64) nested pixels. Check that the jackknife
+    # errors match those of a full-resolution ordering.
+    fname = 'xcell/tests/data/catalog_2mpz_jk.fits'
+    rng = np.random.default_rng(1234)
+    ngal = 5000
+    d = np.zeros(ngal, dtype=[(n, 'f8') for n in
+                              ['SUPRA', 'SUPDEC', 'ZPHOTO', 'ZSPEC',
+                               'JCORR', 'KCORR', 'HCORR', 'W1MCORR',
+                               'W2MCORR', 'BCALCORR', 'RCALCORR',
+                               'ICALCORR']])
+    d['SUPRA'] = 360*rng.random(ngal)
+    d['SUPDEC'] = np.degrees(np.arcsin(2*rng.random(ngal)-1))
+    d['ZSPEC'] = 0.4*rng.random(ngal)
+    d['ZPHOTO'] = d['ZSPEC']
+    bands = ['JCORR', 'KCORR', 'HCORR', 'W1MCORR', 'W2MCORR',
+             'BCALCORR', 'RCALCORR', 'ICALCORR']
+    for b in bands:
+        d[b] = d['ZSPEC'] + 0.1*rng.standard_normal(ngal)
+    fitsio.write(fname, d, clobber=True)
+
+    c = get_config()
+    c['data_catalog'] = fname
+    c['nside'] = 256
+    c['n_jk_dir'] = 20
+    c.pop('path_rerun')
+    m = xc.mappers.Mapper2MPZ(c)
+    m.dndz = m._get_nz()
+    z, nz, enz = m.get_nz(return_jk_error=True)
+
+    # Full-resolution ordering
+    c_s = m.get_catalog()
+    ip = hp.ang2pix(256, c_s['SUPRA'], c_s['SUPDEC'],
+                    lonlat=True, nest=True)
+    c_s = c_s[np.argsort(ip)]
+    _, nz_f, nz_jk_f = xc.mappers.get_DIR_Nz(c_s, c_s, bands,
+                                             zflag='ZSPEC',
+                                             zrange=[0, 0.4],
+                                             nz=100, njk=20)
+    enz_f = np.std(nz_jk_f, axis=0)*np.sqrt(19**2/20)
+    assert np.allclose(nz, nz_f, rtol=1E-10, atol=0)
+    assert np.all(np.fabs(enz-enz_f) < 0.1*np.amax(enz_f))
+    os.remove(fname)
+
+
 @pytest.mark.parametrize('coord', ['G', 'C'])
 def test_get_signal_map(coord):
     cleanup_rerun()
@@ -1,5 +1,6 @@
 import xcell as xc
 from pixell import enmap, reproject
+import numpy as np
 import healpy as hp
 import os
 import pytest
@@ -44,9 +45,13 @@ def test_get_signal_map(cls):
     mm = m.get_signal_map()[0]
     assert (len(mm)/12)**(1/2) == 32
     assert (mb == mm).all()
-    fn = 'xcell/tests/data/ACT_test_signal.fits.gz'
-    mrerun = hp.read_map(fn)
+    assert not mm.flags.writeable
+    fn = 'xcell/tests/data/ACT_test_signal.npy'
+    mrerun = np.load(fn)
     assert (mrerun == mb).all()
+    # Read back from rerun
+    m = cls(conf)
+    assert (m.get_signal_map()[0] == mb).all()
     os.remove(fn)
 
 
@@ -61,7 +66,30 @@ def test_get_mask():
     mm = m.get_mask()
     assert (len(mm)/12)**(1/2) == 32
     assert (mb == mm).all()
-    fn = 'xcell/tests/data/ACT_test_mask.fits.gz'
-    mrerun = hp.read_map(fn)
+    assert not mm.flags.writeable
+    fn = 'xcell/tests/data/ACT_test_mask.npy'
+    mrerun = np.load(fn)
+    assert mrerun.dtype == np.float32
     assert (mrerun == mb).all()
+    # Read back from rerun
+    m = xc.mappers.MapperACTBase(conf)
+    mm = m.get_mask()
+    assert (mm == mb).all()
+    assert not mm.flags.writeable
+    os.remove(fn)
+
+
+def test_get_mask_fits_rerun():
+    # Rerun masks saved as FITS by older versions are still used
+    conf = get_config()
+    conf['path_rerun'] = 'xcell/tests/data/'
+    fn_fits = 'xcell/tests/data/ACT_test_mask.fits.gz'
+    fn = 'xcell/tests/data/ACT_test_mask.npy'
+    hp.write_map(fn_fits, np.ones(hp.nside2npix(32)), overwrite=True)
+    m = xc.mappers.MapperACTBase(conf)
+    mm = m.get_mask()
+    assert np.all(mm == 1)
+    assert mm.dtype == np.float32
+    assert np.all(np.load(fn) == 1)
+    os.remove(fn_fits)
     os.remove(fn)
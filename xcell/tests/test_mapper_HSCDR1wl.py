@@ -155,6 +155,48 @@ def test_rerun():
     remove_rerun(prerun)
 
 
+def test_null_flags():
+    make_hsc_data()
+    c = get_config()
+    m = xc.mappers.MapperHSCDR1wl(c)
+    ngal = len(m._get_catalog_from_raw())
+
+    # Objects with null photo-zs are removed, but
+    # objects with null shapes are not.
+    d = Table.read('xcell/tests/data/hsc_catalog.fits')
+    d['pz_best_frankenz_isnull'] = np.zeros(len(d), dtype=bool)
+    d['pz_best_frankenz_isnull'][0] = True
+    d['ishape_hsm_regauss_e1_isnull'] = np.zeros(len(d), dtype=bool)
+    d['ishape_hsm_regauss_e1_isnull'][1] = True
+    d.write('xcell/tests/data/hsc_catalog.fits', overwrite=True)
+    m = xc.mappers.MapperHSCDR1wl(c)
+    assert len(m._get_catalog_from_raw()) == ngal - 1
+    clean_hsc_data()
+    remove_rerun(c['path_rerun'])
+
+
+def test_catalog_layout():
+    make_hsc_data()
+    c = get_config()
+    cat = xc.mappers.MapperHSCDR1wl(c)._get_catalog_from_raw()
+    assert cat.dtype.names == ('ra', 'dec',
+                               'ishape_hsm_regauss_derived_shape_weight',
+                               'e1', 'e2')
+    assert all(cat.dtype[n].isnative for n in cat.dtype.names)
+    clean_hsc_data()
+
+
+def test_nthreads():
+    make_hsc_data()
+    c = get_config()
+    c['data_catalogs'] = c['data_catalogs']*3
+    cat = xc.mappers.MapperHSCDR1wl(c)._get_catalog_from_raw()
+    c['nthreads'] = 2
+    cat_th = xc.mappers.MapperHSCDR1wl(c)._get_catalog_from_raw()
+    assert np.all(cat == cat_th)
+    clean_hsc_data()
+
+
 def test_get_signal_map():
     make_hsc_data()
     c = get_config()
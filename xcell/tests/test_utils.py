@@ -20,6 +20,54 @@ def test_map_from_points():
                                        nside, in_radians=True)
     assert np.all(m == 1)
 
+    # Precomputed pixel indices
+    m = xc.mappers.get_map_from_points(None, nside,
+                                       ipix=np.arange(npix))
+    assert np.all(m == 1)
+
+
+def test_get_ipix():
+    nside = 32
+    ra = 360*np.random.rand(1000)
+    dec = np.degrees(np.arcsin(2*np.random.rand(1000)-1))
+    for nest in [False, True]:
+        ipix = hp.ang2pix(nside, ra, dec, lonlat=True, nest=nest)
+        assert np.all(xc.mappers.get_ipix(nside, ra, dec,
+                                          nest=nest) == ipix)
+        assert np.all(xc.mappers.get_ipix(nside,
+                                          np.radians(ra),
+                                          np.radians(dec),
+                                          nest=nest,
+                                          in_radians=True) == ipix)
+
+    # Threaded hashing of large catalogs
+    ra = 360*np.random.rand(400000)
+    dec = np.degrees(np.arcsin(2*np.random.rand(400000)-1))
+    ipix = hp.ang2pix(nside, ra, dec, lonlat=True)
+    assert np.all(xc.mappers.get_ipix(nside, ra, dec, nthreads=4) == ipix)
+
+    # Single precision is enough to recover pixel centres
+    ra, dec = hp.pix2ang(nside, np.arange(hp.nside2npix(nside)),
+                         lonlat=True)
+    ipix = xc.mappers.get_ipix(nside, ra, dec, dtype=np.float32)
+    assert np.all(ipix == np.arange(hp.nside2npix(nside)))
+
+
+def test_maps_from_points():
+    nside = 32
+    npix = hp.nside2npix(nside)
+    ra, dec = hp.pix2ang(nside,
+                         np.arange(npix),
+                         lonlat=True)
+    cat = {'RA': ra, 'DEC': dec}
+    w1 = np.random.rand(npix)
+    w2 = np.random.rand(npix)
+    m1, m2 = xc.mappers.get_maps_from_points(cat, nside, [w1, w2])
+    assert np.all(m1 == xc.mappers.get_map_from_points(cat, nside, w=w1))
+    assert np.all(m2 == xc.mappers.get_map_from_points(cat, nside, w=w2))
+    assert np.all(m1 == w1)
+    assert np.all(m2 == w2)
+
 
 def test_get_DIR_Nz():
     # If cat_spec and cat_photo are the same,